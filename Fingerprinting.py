@@ -0,0 +1,201 @@
+import os
+import time
+import json
+import pickle
+import numpy as np
+from collections import Counter
+from scipy.spatial import cKDTree
+from SignalFiltering import load_access_points
+
+def extract_fingerprints(ap_names, all_data, missing_rssi=-110.0):
+    """Extracts AP-indexed RSSI fingerprints labelled with the 'Appartement' field from positioning data
+       Accepts: List of AP names, list of positioning snapshots, RSSI value for APs that did not see the beacon
+       Returns:  Float32 numpy array of fingerprints (n x APs), list of apartment labels
+    """
+    aps_mapping = {ap_names[i]: i for i in range(0, len(ap_names))}
+    rows = []
+    labels = []
+    for s in all_data:
+        for b in s['Beacons'].values():
+            row = np.full(len(ap_names), missing_rssi, dtype=np.float32)
+            for ap, rssi in zip(b['APs'], b['RSSIs']):
+                if ap in aps_mapping: row[aps_mapping[ap]] = rssi
+            rows.append(row)
+            labels.append(b.get('Appartement'))
+    if len(rows) == 0:
+        return np.zeros((0, len(ap_names)), dtype=np.float32), labels
+    return np.vstack(rows), labels
+
+def build_fingerprint_db(ap_names, missing_rssi=-110.0, capacity=1024, rebuild_ratio=0.1):
+    """Builds an empty fingerprint database, fingerprints are stored in a compact float32 matrix indexed by a KD-tree
+       Accepts: List of AP names, RSSI value for APs that did not see the beacon, initial capacity in fingerprints, ratio of pending (not yet indexed) to indexed fingerprints that triggers a KD-tree rebuild
+       Returns:  Dictionary fingerprint database
+    """
+    return {
+        'ap_names': list(ap_names),
+        'missing_rssi': missing_rssi,
+        'rebuild_ratio': rebuild_ratio,
+        'fingerprints': np.zeros((capacity, len(ap_names)), dtype=np.float32),
+        'label_ids': np.zeros(capacity, dtype=np.int32),
+        'labels': [],
+        'labels_mapping': {},
+        'size': 0,
+        # Fingerprints [0, indexed) are in the main tree, [indexed, size) are pending in a small secondary tree until the next rebuild
+        'indexed': 0,
+        'tree': None,
+        'pending_tree': None
+    }
+
+def insert_fingerprints(db, fingerprints, labels):
+    """Incrementally inserts labelled fingerprints into a small secondary KD-tree of pending fingerprints, the main KD-tree is rebuilt once enough fingerprints are pending
+       Accepts: Fingerprint database, numpy array of fingerprints (n x APs), list of apartment labels
+       Returns:  Number of fingerprints in the database
+    """
+    n = len(labels)
+    if n == 0: return db['size']
+    size = db['size']
+    capacity = db['fingerprints'].shape[0]
+    if size + n > capacity or not db['fingerprints'].flags.writeable:
+        capacity = max(capacity, 1)
+        while capacity < size + n:
+            capacity *= 2
+        grown = np.zeros((capacity, len(db['ap_names'])), dtype=np.float32)
+        grown[:size] = db['fingerprints'][:size]
+        grown_ids = np.zeros(capacity, dtype=np.int32)
+        grown_ids[:size] = db['label_ids'][:size]
+        db['fingerprints'] = grown
+        db['label_ids'] = grown_ids
+    for l in labels:
+        if l not in db['labels_mapping']:
+            db['labels_mapping'][l] = len(db['labels'])
+            db['labels'].append(l)
+    db['fingerprints'][size:size + n] = fingerprints
+    db['label_ids'][size:size + n] = [db['labels_mapping'][l] for l in labels]
+    db['size'] = size + n
+    if db['size'] - db['indexed'] > db['rebuild_ratio'] * max(db['indexed'], 1):
+        rebuild_fingerprint_index(db)
+    else:
+        db['pending_tree'] = cKDTree(db['fingerprints'][db['indexed']:db['size']], copy_data=True)
+    return db['size']
+
+def rebuild_fingerprint_index(db):
+    """Rebuilds the KD-tree over all fingerprints of the database
+       Accepts: Fingerprint database
+       Returns:  None
+    """
+    db['tree'] = cKDTree(db['fingerprints'][:db['size']]) if db['size'] > 0 else None
+    db['pending_tree'] = None
+    db['indexed'] = db['size']
+
+def build_fingerprint_db_from_data(ap_path, all_data, missing_rssi=-110.0):
+    """Builds a fingerprint database from historical raw positioning data
+       Accepts: Path to access points data, list of positioning snapshots, RSSI value for APs that did not see the beacon
+       Returns:  Dictionary fingerprint database
+    """
+    ap_names, _ = load_access_points(ap_path)
+    fingerprints, labels = extract_fingerprints(ap_names, all_data, missing_rssi)
+    db = build_fingerprint_db(ap_names, missing_rssi, capacity=max(len(labels), 1))
+    insert_fingerprints(db, fingerprints, labels)
+    rebuild_fingerprint_index(db)
+    return db
+
+def query_fingerprints(db, fingerprints, k=5):
+    """Batched k-NN lookup of fingerprints, every query is labelled by majority vote of its k nearest stored fingerprints (ties go to the nearest)
+       Accepts: Fingerprint database, numpy array of fingerprints (n x APs), number of neighbours k
+       Returns:  List of apartment labels, numpy array of neighbour distances (n x k)
+    """
+    fingerprints = np.asarray(fingerprints, dtype=np.float32).reshape(-1, len(db['ap_names']))
+    n = len(fingerprints)
+    k = min(k, db['size'])
+    if n == 0:
+        return [], np.zeros((0, k), dtype=np.float64)
+    if k == 0:
+        return [None] * n, np.zeros((n, 0), dtype=np.float64)
+    distances = []
+    ids = []
+    if db['tree'] is not None:
+        d, i = db['tree'].query(fingerprints, k=min(k, db['indexed']))
+        distances.append(d.reshape(n, -1))
+        ids.append(i.reshape(n, -1))
+    if db['pending_tree'] is not None:
+        d, i = db['pending_tree'].query(fingerprints, k=min(k, db['size'] - db['indexed']))
+        distances.append(d.reshape(n, -1))
+        ids.append(i.reshape(n, -1) + db['indexed'])
+    distances = np.hstack(distances)
+    ids = np.hstack(ids)
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    distances = np.take_along_axis(distances, order, axis=1)
+    neighbours = db['label_ids'][np.take_along_axis(ids, order, axis=1)]
+
+    labels = []
+    for row in neighbours:
+        votes = Counter(row.tolist())
+        best = max(votes.values())
+        labels.append(db['labels'][next(l for l in row.tolist() if votes[l] == best)])
+    return labels, distances
+
+def locate_snapshot(db, snapshot, k=5):
+    """Labels every beacon of a new positioning snapshot with an apartment by fingerprint k-NN lookup
+       Accepts: Fingerprint database, positioning snapshot, number of neighbours k
+       Returns:  Dictionary of beacon Mac address and apartment label
+    """
+    fingerprints, _ = extract_fingerprints(db['ap_names'], [snapshot], db['missing_rssi'])
+    labels, _ = query_fingerprints(db, fingerprints, k)
+    return dict(zip(snapshot['Beacons'].keys(), labels))
+
+def save_fingerprint_db(db, path):
+    """Persists the fingerprint database into a directory (fingerprints and label ids as .npy, the built KD-tree as .pickle, metadata as .json). Pending fingerprints are indexed first.
+       Accepts: Fingerprint database, path to directory
+       Returns:  None
+    """
+    if not os.path.exists(path): os.makedirs(path)
+    if db['indexed'] < db['size']: rebuild_fingerprint_index(db)
+    with open(os.path.join(path, 'tree.pickle'), 'wb') as outfile:
+        pickle.dump(db['tree'], outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    np.save(os.path.join(path, 'fingerprints.npy'), db['fingerprints'][:db['size']])
+    np.save(os.path.join(path, 'label_ids.npy'), db['label_ids'][:db['size']])
+    with open(os.path.join(path, 'metadata.json'), 'w') as outfile:
+        json.dump({'ap_names': db['ap_names'], 'labels': db['labels'], 'missing_rssi': db['missing_rssi'], 'rebuild_ratio': db['rebuild_ratio']}, outfile)
+
+def load_fingerprint_db(path):
+    """Loads a persisted fingerprint database. The pickled KD-tree is read into memory (it holds its own float64 copy of the fingerprints), fingerprints and label ids are memory-mapped read-only, so the float32 fingerprints are not read until the first insert copies them. The tree is rebuilt only if it is missing or does not match the fingerprints.
+       Accepts: Path to directory written by save_fingerprint_db
+       Returns:  Dictionary fingerprint database
+    """
+    with open(os.path.join(path, 'metadata.json')) as json_file:
+        metadata = json.load(json_file)
+    fingerprints = np.load(os.path.join(path, 'fingerprints.npy'), mmap_mode='r')
+    label_ids = np.load(os.path.join(path, 'label_ids.npy'), mmap_mode='r')
+    db = build_fingerprint_db(metadata['ap_names'], metadata['missing_rssi'], 0, metadata['rebuild_ratio'])
+    db['fingerprints'] = fingerprints
+    db['label_ids'] = label_ids
+    db['labels'] = metadata['labels']
+    db['labels_mapping'] = {metadata['labels'][i]: i for i in range(0, len(metadata['labels']))}
+    db['size'] = len(label_ids)
+    tree_path = os.path.join(path, 'tree.pickle')
+    if os.path.exists(tree_path):
+        with open(tree_path, 'rb') as tree_file:
+            db['tree'] = pickle.load(tree_file)
+        db['indexed'] = db['size']
+    if db['size'] > 0 and (db['tree'] is None or db['tree'].n != db['size']):
+        rebuild_fingerprint_index(db)
+    return db
+
+def measure_fingerprint_queries(db, all_data, k=5):
+    """Measures batched k-NN query latency and accuracy against the 'Appartement' labels of positioning data
+       Accepts: Fingerprint database, list of labelled positioning snapshots (e.g. held-out from the database), number of neighbours k
+       Returns:  Dictionary with query count, total and per-query latency in seconds and accuracy (0-1)
+    """
+    fingerprints, labels = extract_fingerprints(db['ap_names'], all_data, db['missing_rssi'])
+    start = time.time()
+    predicted, _ = query_fingerprints(db, fingerprints, k)
+    took = time.time() - start
+    correct = sum(1 for p, l in zip(predicted, labels) if p == l)
+    report = {
+        'queries': len(labels),
+        'latency': took,
+        'latency_per_query': took / max(len(labels), 1),
+        'accuracy': correct / float(max(len(labels), 1))
+    }
+    print('Fingerprint queries: {}'.format(report))
+    return report
@@ -0,0 +1,96 @@
+import numpy as np
+
+def build_apartments_labels():
+    """Builds a list of apartment labels specific to the datasets in the project.
+       Accepts: None
+       Returns:  List of strings
+    """
+    appts = []
+    apt_string = 'APT_{}_FLOOR_{}_{}'
+    for i in range(1, 7):
+        appts.append(apt_string.format(i, 0, 'B'))
+        appts.append(apt_string.format(i, 0, 'U'))
+
+    # 1-5
+    for i in range(1, 9):
+        for j in range(1, 6):
+            appts.append(apt_string.format(i, j, 'B'))
+
+    for i in range(1, 10):
+        for j in range(1, 6):
+            appts.append(apt_string.format(i, j, 'U'))
+
+    # 6-7
+    for i in range(1, 5):
+        appts.append(apt_string.format(i, 6, 'U'))
+        appts.append(apt_string.format(i, 7, 'U'))
+        appts.append(apt_string.format(i, 6, 'B'))
+        appts.append(apt_string.format(i, 7, 'B'))
+    # 8-11
+    for i in range(1, 5):
+        appts.append(apt_string.format(i, 8, 'B'))
+        appts.append(apt_string.format(i, 9, 'B'))
+        appts.append(apt_string.format(i, 10, 'B'))
+        appts.append(apt_string.format(i, 11, 'B'))
+    for i in range(1, 4):
+        appts.append(apt_string.format(i, 8, 'U'))
+        appts.append(apt_string.format(i, 9, 'U'))
+        appts.append(apt_string.format(i, 10, 'U'))
+        appts.append(apt_string.format(i, 11, 'U'))
+
+    # 12-15
+    for i in range(1, 4):
+        appts.append(apt_string.format(i, 12, 'B'))
+        appts.append(apt_string.format(i, 13, 'B'))
+        appts.append(apt_string.format(i, 14, 'B'))
+        appts.append(apt_string.format(i, 15, 'B'))
+    for i in range(1, 3):
+        appts.append(apt_string.format(i, 12, 'U'))
+        appts.append(apt_string.format(i, 13, 'U'))
+        appts.append(apt_string.format(i, 14, 'U'))
+        appts.append(apt_string.format(i, 15, 'U'))
+
+    return appts
+
+def most_frequent(List):
+    """ Helper method of aggregate_tenant_hourly_positions
+       Accepts: List of apartments
+       Returns:  Frequency of most visited apartment
+   """
+    counter = 0
+    num = List[0]
+    for i in List:
+        curr_frequency = List.count(i)
+        if (curr_frequency > counter):
+            counter = curr_frequency
+            num = i
+    return num
+
+def calculate_levenshtein_distance(seq1, seq2):
+    """ Calculate Levenshtein distance between two lists of words
+        Accepts: List of words seq1 and seq2
+        Returns:  Double similarity
+    """
+    size_x = len(seq1) + 1
+    size_y = len(seq2) + 1
+    matrix = np.zeros((size_x, size_y))
+    for x in range(size_x):
+        matrix[x, 0] = x
+    for y in range(size_y):
+        matrix[0, y] = y
+
+    for x in range(1, size_x):
+        for y in range(1, size_y):
+            if seq1[x - 1] == seq2[y - 1]:
+                matrix[x, y] = min(
+                    matrix[x - 1, y] + 1,
+                    matrix[x - 1, y - 1],
+                    matrix[x, y - 1] + 1
+                )
+            else:
+                matrix[x, y] = min(
+                    matrix[x - 1, y] + 1,
+                    matrix[x - 1, y - 1] + 1,
+                    matrix[x, y - 1] + 1
+                )
+    return (matrix[size_x - 1, size_y - 1])
@@ -0,0 +1,372 @@
+import time
+import json
+import asyncio
+import numpy as np
+import networkx as nx
+from collections import Counter, deque
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+from OccupancyIndex import parse_timestamp, build_occupancy_index, append_occupancy_snapshot, TIMESTAMP_FORMAT
+from Helpers import build_apartments_labels
+
+def aggregate_snapshot_lines(lines, step_seconds):
+    """CPU-heavy ingestion stage run in the process pool: parses newline-delimited JSON snapshots and counts apartments per (time slot, beacon). Malformed snapshots (bad JSON, timestamp or beacon records) are skipped as invalid.
+       Accepts: List of raw snapshot lines (bytes or strings), slot size in seconds
+       Returns:  Dictionary of slot start datetime and dictionary of beacon Mac address and apartment Counter, number of invalid lines, dictionary of slot start datetime and number of snapshots
+    """
+    counts = {}
+    invalid = 0
+    snapshots = Counter()
+    for line in lines:
+        try:
+            s = json.loads(line)
+            t = parse_timestamp(s['Timestamp'])
+            apts = [(beacon_mac, b.get('Appartement', 'OUTSIDE')) for beacon_mac, b in s['Beacons'].items()]
+            if not all(isinstance(beacon_mac, str) and isinstance(apt, str) for beacon_mac, apt in apts):
+                raise TypeError('Beacon Mac addresses and apartments must be strings')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            invalid += 1
+            continue
+        midnight = t.replace(hour=0, minute=0, second=0, microsecond=0)
+        slot_start = t - timedelta(seconds=(t - midnight).total_seconds() % step_seconds)
+        if slot_start not in counts: counts[slot_start] = {}
+        snapshots[slot_start] += 1
+        per_slot = counts[slot_start]
+        for beacon_mac, apt in apts:
+            if beacon_mac not in per_slot: per_slot[beacon_mac] = Counter()
+            per_slot[beacon_mac][apt] += 1
+    return counts, invalid, snapshots
+
+def build_ingestion_pipeline(step=timedelta(hours=1), forget_after=24, max_ahead=168):
+    """Builds the incremental state fed by the ingestion service: last hourly position of every beacon (as aggregate_tenant_hourly_positions), occupancy index and building transitions graph
+       Accepts: Time slot size (timedelta), number of slots after which beacons not seen are forgotten, maximal number of slots a snapshot may be ahead of the last closed slot
+       Returns:  Dictionary pipeline state
+    """
+    return {
+        'step': step,
+        'forget_after': forget_after,
+        'max_ahead': max_ahead,
+        'start': None,
+        'closed': 0,
+        'counts': {},
+        'apartments': build_apartments_labels(),
+        # Beacon Mac address and tuple (slot, most frequent apartment) of the last slot the beacon was seen in
+        'last_apartments': {},
+        'occupancy_index': None,
+        'graph': nx.DiGraph(),
+        'late': 0,
+        'invalid': 0
+    }
+
+def _close_slot(pipeline, slot):
+    """ Helper method of merge_slot_counts, aggregates a finished time slot into hourly positions, occupancy and the transitions graph
+        Accepts: Pipeline state, slot number
+        Returns:  None
+    """
+    per_slot = pipeline['counts'].pop(slot, {})
+    last = pipeline['last_apartments']
+    graph = pipeline['graph']
+    occupied = set()
+    for beacon_mac, c in per_slot.items():
+        apt = c.most_common(1)[0][0]
+        # A beacon not seen in the previous slot was 'OUTSIDE'
+        (last_slot, previous) = last.get(beacon_mac, (-1, 'OUTSIDE'))
+        if last_slot != slot - 1: previous = 'OUTSIDE'
+        last[beacon_mac] = (slot, apt)
+        if apt == 'OUTSIDE': continue
+        occupied.add(apt)
+        if not graph.has_node(apt): graph.add_node(apt, stays=0)
+        graph.nodes[apt]['stays'] += 1
+        if previous != 'OUTSIDE' and previous != apt:
+            if graph.has_edge(previous, apt):
+                graph[previous][apt]['weight'] += 1
+            else:
+                graph.add_edge(previous, apt, weight=1)
+
+    snapshot = {
+        'Occupancy': {a: int(a in occupied) for a in pipeline['apartments']},
+        'Timestamp': (pipeline['start'] + slot * pipeline['step']).strftime(TIMESTAMP_FORMAT)
+    }
+    if pipeline['occupancy_index'] is None:
+        pipeline['occupancy_index'] = build_occupancy_index([snapshot], step=pipeline['step'])
+    else:
+        append_occupancy_snapshot(pipeline['occupancy_index'], snapshot)
+    if slot % pipeline['forget_after'] == 0:
+        for beacon_mac in [b for b, (last_slot, apt) in last.items() if last_slot < slot - pipeline['forget_after']]:
+            del last[beacon_mac]
+    pipeline['closed'] = slot + 1
+
+def merge_slot_counts(pipeline, counts, invalid=0, snapshots=None):
+    """Merges a batch of slot counts into the pipeline, every slot older than the newest one seen is closed. Counts for already closed slots are dropped as late, snapshots more than max_ahead slots past the last closed slot (e.g. mistyped timestamps) are dropped as invalid so they cannot move the clock.
+       Accepts: Pipeline state, slot counts, invalid lines number and snapshots per slot (see aggregate_snapshot_lines)
+       Returns:  Number of closed slots
+    """
+    pipeline['invalid'] += invalid
+    if len(counts) == 0: return pipeline['closed']
+    if pipeline['start'] is None:
+        pipeline['start'] = min(counts)
+    for slot_start, per_slot in counts.items():
+        slot = (slot_start - pipeline['start']) // pipeline['step']
+        if slot < pipeline['closed']:
+            pipeline['late'] += sum(sum(c.values()) for c in per_slot.values())
+            continue
+        if slot > pipeline['closed'] + pipeline['max_ahead']:
+            pipeline['invalid'] += snapshots[slot_start] if snapshots is not None else 1
+            continue
+        if slot not in pipeline['counts']: pipeline['counts'][slot] = {}
+        merged = pipeline['counts'][slot]
+        for beacon_mac, c in per_slot.items():
+            if beacon_mac in merged: merged[beacon_mac].update(c)
+            else: merged[beacon_mac] = c
+    if len(pipeline['counts']) > 0:
+        for slot in range(pipeline['closed'], max(pipeline['counts'])):
+            _close_slot(pipeline, slot)
+    return pipeline['closed']
+
+def flush_pipeline(pipeline):
+    """Closes every open time slot of the pipeline (e.g. on shutdown)
+       Accepts: Pipeline state
+       Returns:  Number of closed slots
+    """
+    if len(pipeline['counts']) > 0:
+        for slot in range(pipeline['closed'], max(pipeline['counts']) + 1):
+            _close_slot(pipeline, slot)
+    return pipeline['closed']
+
+def build_ingestion_service(host='127.0.0.1', port=8765, queue_size=1024, batch_size=32, batch_timeout=0.05, workers=2, max_in_flight=None, latency_window=10000):
+    """Builds an asyncio ingestion service accepting newline-delimited JSON snapshots (raw schema) over a local TCP socket
+       Accepts: Host and port to listen on (port 0 picks a free one), bounded queue size in snapshots, maximal batch size, batch timeout in seconds, process pool size, maximal number of batches processed at once (workers if None), number of most recent snapshot latencies kept
+       Returns:  Dictionary ingestion service
+    """
+    return {
+        'host': host,
+        'port': port,
+        'queue_size': queue_size,
+        'batch_size': batch_size,
+        'batch_timeout': batch_timeout,
+        'workers': workers,
+        'max_in_flight': max_in_flight or workers,
+        'pipeline': build_ingestion_pipeline(),
+        'queue': None,
+        'server': None,
+        'pool': None,
+        'batcher': None,
+        'connections': {},
+        'received': 0,
+        'processed': 0,
+        'batches': 0,
+        'failed': 0,
+        'latencies': deque(maxlen=latency_window)
+    }
+
+async def _handle_connection(service, reader, writer):
+    """ Helper method of start_ingestion_service, reads snapshots of one connection. Reading stops while the queue is full or while the sender does not read its acks, which pushes back on the sender through the socket.
+        Accepts: Ingestion service, asyncio stream reader and writer
+        Returns:  None
+    """
+    service['connections'][writer] = asyncio.current_task()
+    seq = 0
+    try:
+        while True:
+            # Acks are written by the batcher, wait here until they are flushed so unread acks cannot pile up in the transport buffer
+            await writer.drain()
+            line = await reader.readline()
+            if not line: break
+            if not line.strip(): continue
+            await service['queue'].put((line, writer, seq, time.time()))
+            service['received'] += 1
+            seq += 1
+    except (ConnectionError, ValueError):
+        pass
+    service['connections'].pop(writer, None)
+    writer.close()
+
+def _complete_batch(service, in_flight):
+    """ Helper method of _batch_snapshots, merges the oldest processed batch into the pipeline and acknowledges its snapshots to their senders. A batch that failed in the process pool is logged, counted and still acknowledged, so the service keeps running.
+        Accepts: Ingestion service, deque of in-flight (future, batch of queued snapshots) tuples
+        Returns:  None
+    """
+    future, batch = in_flight.popleft()
+    try:
+        counts, invalid, snapshots = future.result()
+        merge_slot_counts(service['pipeline'], counts, invalid, snapshots)
+    except Exception as e:
+        print('Exception: failed batch of {} snapshots: {!r}'.format(len(batch), e))
+        service['failed'] += len(batch)
+    now = time.time()
+    acks = {}
+    for (line, writer, seq, received) in batch:
+        if writer not in acks: acks[writer] = []
+        acks[writer].append(seq)
+        service['latencies'].append(now - received)
+    for writer, seqs in acks.items():
+        if not writer.is_closing():
+            writer.write((json.dumps({'Acked': seqs}) + '\n').encode())
+    service['processed'] += len(batch)
+    service['batches'] += 1
+
+async def _next_queued(queue, service, in_flight, timeout=None):
+    """ Helper method of _batch_snapshots, waits for the next queued snapshot while completing finished batches in order
+        Accepts: Snapshot queue, ingestion service, deque of in-flight batches, timeout in seconds (None to wait forever)
+        Returns:  Queued snapshot tuple, None on shutdown, raises asyncio.TimeoutError on timeout
+    """
+    getter = asyncio.ensure_future(queue.get())
+    try:
+        while True:
+            while len(in_flight) > 0 and in_flight[0][0].done():
+                _complete_batch(service, in_flight)
+            waiting = [getter] + ([in_flight[0][0]] if len(in_flight) > 0 else [])
+            done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done: return getter.result()
+            if len(done) == 0: raise asyncio.TimeoutError()
+    finally:
+        getter.cancel()
+
+async def _batch_snapshots(service):
+    """ Helper method of start_ingestion_service, batches queued snapshots and sends batches to the process pool, at most max_in_flight at once, merging results in order
+        Accepts: Ingestion service
+        Returns:  None
+    """
+    loop = asyncio.get_running_loop()
+    queue = service['queue']
+    step_seconds = service['pipeline']['step'].total_seconds()
+    in_flight = deque()
+    stopping = False
+    while not stopping:
+        item = await _next_queued(queue, service, in_flight)
+        if item is None: break
+        batch = [item]
+        deadline = loop.time() + service['batch_timeout']
+        while len(batch) < service['batch_size']:
+            timeout = deadline - loop.time()
+            if timeout <= 0: break
+            try:
+                item = await _next_queued(queue, service, in_flight, timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        lines = [b[0] for b in batch]
+        in_flight.append((loop.run_in_executor(service['pool'], aggregate_snapshot_lines, lines, step_seconds), batch))
+        while len(in_flight) >= service['max_in_flight']:
+            await asyncio.wait([in_flight[0][0]])
+            _complete_batch(service, in_flight)
+    while len(in_flight) > 0:
+        await asyncio.wait([in_flight[0][0]])
+        _complete_batch(service, in_flight)
+
+async def start_ingestion_service(service):
+    """Starts the ingestion service: process pool, TCP server and batching task
+       Accepts: Ingestion service
+       Returns:  Port the service listens on
+    """
+    service['queue'] = asyncio.Queue(maxsize=service['queue_size'])
+    service['pool'] = ProcessPoolExecutor(max_workers=service['workers'])
+    service['server'] = await asyncio.start_server(lambda r, w: _handle_connection(service, r, w), service['host'], service['port'])
+    service['port'] = service['server'].sockets[0].getsockname()[1]
+    service['batcher'] = asyncio.ensure_future(_batch_snapshots(service))
+    return service['port']
+
+async def stop_ingestion_service(service):
+    """Stops accepting snapshots, processes everything queued, closes all open time slots and shuts the process pool down
+       Accepts: Ingestion service
+       Returns:  None
+    """
+    service['server'].close()
+    await service['server'].wait_closed()
+    # Close connections while the batcher still drains the queue, so no handler stays blocked on a full queue. Connections that do not read their acks are aborted.
+    connections = dict(service['connections'])
+    for writer in connections:
+        writer.close()
+    if len(connections) > 0:
+        await asyncio.wait(list(connections.values()), timeout=1.0)
+    for writer, handler in connections.items():
+        if not handler.done(): writer.transport.abort()
+    await asyncio.gather(*connections.values(), return_exceptions=True)
+    await service['queue'].put(None)
+    await service['batcher']
+    flush_pipeline(service['pipeline'])
+    service['pool'].shutdown()
+
+def latency_percentiles(latencies):
+    """Calculates latency percentiles
+       Accepts: List of latencies in seconds
+       Returns:  Dictionary of percentile name and latency in milliseconds
+    """
+    if len(latencies) == 0: return {}
+    p = np.percentile(np.asarray(latencies) * 1000, [50, 90, 99, 100])
+    return {'p50': float(p[0]), 'p90': float(p[1]), 'p99': float(p[2]), 'max': float(p[3])}
+
+async def replay_snapshots(path, host, port, speed=60.0, repeat=1):
+    """Local replay client, streams a raw positioning dataset to the ingestion service at speed x real-time (as fast as possible if speed is None) and measures end-to-end latency from send to acknowledgement
+       Accepts: Path to raw positioning data, service host and port, replay speed, number of replays (timestamps of every replay are shifted past the previous one)
+       Returns:  Dictionary with sent snapshots, duration in seconds, snapshots per second and latency percentiles in milliseconds
+    """
+    with open(path) as json_file:
+        data = json.load(json_file)
+    times = [parse_timestamp(s['Timestamp']) for s in data]
+    period = times[-1] - times[0] + (times[1] - times[0] if len(times) > 1 else timedelta(minutes=10))
+    reader, writer = await asyncio.open_connection(host, port)
+    sent = {}
+    latencies = []
+    total = len(data) * repeat
+
+    async def read_acks():
+        while len(latencies) < total:
+            line = await reader.readline()
+            if not line: break
+            now = time.time()
+            for seq in json.loads(line)['Acked']:
+                latencies.append(now - sent.pop(seq))
+
+    acks = asyncio.ensure_future(read_acks())
+    start = time.time()
+    seq = 0
+    for r in range(0, repeat):
+        for i in range(0, len(data)):
+            offset = times[i] - times[0] + r * period
+            if speed:
+                delay = start + offset.total_seconds() / speed - time.time()
+                if delay > 0: await asyncio.sleep(delay)
+            s = dict(data[i])
+            s['Timestamp'] = (times[0] + offset).strftime(TIMESTAMP_FORMAT)
+            sent[seq] = time.time()
+            writer.write((json.dumps(s) + '\n').encode())
+            # Blocks while the service pushes back
+            await writer.drain()
+            seq += 1
+    await acks
+    took = time.time() - start
+    writer.close()
+    await writer.wait_closed()
+    report = {'sent': total, 'duration': took, 'snapshots_per_second': total / took}
+    report.update(latency_percentiles(latencies))
+    return report
+
+async def _run_load_test(path, speed, repeat, workers):
+    """ Helper method of run_load_test
+        Accepts: Path to raw positioning data, replay speed, number of replays, process pool size
+        Returns:  Tuple of client report and ingestion service
+    """
+    service = build_ingestion_service(port=0, workers=workers)
+    port = await start_ingestion_service(service)
+    report = await replay_snapshots(path, service['host'], port, speed, repeat)
+    await stop_ingestion_service(service)
+    return report, service
+
+def run_load_test(path, speed=None, repeat=1, workers=2):
+    """Runs the ingestion service and the replay client locally and prints end-to-end latency percentiles
+       Accepts: Path to raw positioning data, replay speed (None for as fast as possible), number of replays, process pool size
+       Returns:  Dictionary client report
+    """
+    report, service = asyncio.run(_run_load_test(path, speed, repeat, workers))
+    pipeline = service['pipeline']
+    print('Replay: {}'.format(report))
+    print('Service: received {}, processed {} in {} batches, {} failed, service latency {}'.format(service['received'], service['processed'], service['batches'], service['failed'], latency_percentiles(service['latencies'])))
+    print('Pipeline: {} hours closed, {} beacons tracked, {} graph edges, {} late, {} invalid'.format(pipeline['closed'], len(pipeline['last_apartments']), len(pipeline['graph'].edges()), pipeline['late'], pipeline['invalid']))
+    return report
+
+if __name__ == "__main__":
+    run_load_test('datasets/raw positioning data May-June(2019)/raw_1day_data_sample.json', speed=6000, repeat=3)
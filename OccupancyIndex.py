@@ -0,0 +1,236 @@
+import json
+import numpy as np
+from datetime import datetime as dt, timedelta
+
+TIMESTAMP_FORMAT = "%m/%d/%Y, %H:%M:%S"
+
+def parse_timestamp(timestamp):
+    """Parses a dataset timestamp, datetime objects are returned unchanged
+       Accepts: Timestamp string (e.g. '01/31/2019, 00:00:00') or datetime
+       Returns:  datetime
+    """
+    if isinstance(timestamp, dt):
+        return timestamp
+    return dt.strptime(timestamp, TIMESTAMP_FORMAT)
+
+def build_apartment_groups(apartments):
+    """Builds apartment groups (whole complex, building side, floor, floor per building side) for a list of apartment labels
+       Accepts: List of apartment labels (e.g. 'APT_2_FLOOR_10_B')
+       Returns:  Dictionary of group name and list of apartment column indices, e.g. {'ALL': [...], 'SIDE_B': [...], 'FLOOR_10': [...], 'FLOOR_10_B': [...]}
+    """
+    groups = {'ALL': list(range(0, len(apartments)))}
+    for i in range(0, len(apartments)):
+        parts = apartments[i].split('_')
+        floor = 'FLOOR_{}'.format(parts[3])
+        side = parts[4]
+        for g in [floor, 'SIDE_{}'.format(side), '{}_{}'.format(floor, side)]:
+            if g not in groups: groups[g] = []
+            groups[g].append(i)
+    return groups
+
+def build_occupancy_index(occupancy_data, step=None, capacity=None):
+    """Builds a prefix-sum occupancy index over an occupancy dataset, so any time-range x apartment-group query is O(1)
+       Accepts: List of occupancy snapshots ({'Occupancy': {apt: 0/1}, 'Timestamp': str}), step (timedelta granularity, inferred from the first two timestamps if None), initial capacity in time slots
+       Returns:  Dictionary index with apartments, groups, start time, step, slots count and cumulative sums per apartment and per group
+    """
+    apartments = list(occupancy_data[0]['Occupancy'].keys())
+    groups = build_apartment_groups(apartments)
+    start = parse_timestamp(occupancy_data[0]['Timestamp'])
+    if step is None:
+        if len(occupancy_data) < 2:
+            raise ValueError('Cannot infer step from a single snapshot, pass step explicitly')
+        step = parse_timestamp(occupancy_data[1]['Timestamp']) - start
+    if capacity is None:
+        capacity = len(occupancy_data)
+    capacity = max(capacity, 1)
+
+    # Group membership matrix, group cumulative sums are apartment cumulative sums projected onto it
+    membership = np.zeros((len(apartments), len(groups)), dtype=np.int32)
+    group_names = list(groups.keys())
+    for g in range(0, len(group_names)):
+        membership[groups[group_names[g]], g] = 1
+
+    index = {
+        'apartments': apartments,
+        'apartments_mapping': {apartments[i]: i for i in range(0, len(apartments))},
+        'groups': groups,
+        'group_names': group_names,
+        'groups_mapping': {group_names[i]: i for i in range(0, len(group_names))},
+        'membership': membership,
+        'start': start,
+        'step': step,
+        'slots': 0,
+        # Row t holds sums over slots [0, t), row 0 is all zeros
+        'apartment_cumsum': np.zeros((capacity + 1, len(apartments)), dtype=np.int32),
+        'group_cumsum': np.zeros((capacity + 1, len(group_names)), dtype=np.int32)
+    }
+    append_occupancy_snapshots(index, occupancy_data)
+    return index
+
+def load_occupancy_index(path, step=None):
+    """Builds an occupancy index from an occupancy dataset file (10 minutes, 1h or 2h granularity)
+       Accepts: Path to occupancy data, step (timedelta, inferred if None)
+       Returns:  Dictionary index (see build_occupancy_index)
+    """
+    with open(path) as json_file:
+        data = json.load(json_file)
+        return build_occupancy_index(data, step)
+
+def _ensure_capacity(index, slots):
+    """ Helper method of append_occupancy_snapshots, grows cumulative arrays by doubling
+        Accepts: Occupancy index, number of slots that have to fit
+        Returns:  None
+    """
+    capacity = index['apartment_cumsum'].shape[0] - 1
+    if slots <= capacity: return
+    while capacity < slots:
+        capacity *= 2
+    for key in ['apartment_cumsum', 'group_cumsum']:
+        old = index[key]
+        new = np.zeros((capacity + 1, old.shape[1]), dtype=old.dtype)
+        new[:index['slots'] + 1] = old[:index['slots'] + 1]
+        index[key] = new
+
+def append_occupancy_snapshots(index, occupancy_data):
+    """Incrementally appends occupancy snapshots to the index. Snapshots must be in time order, missing slots between snapshots are treated as unoccupied.
+       Accepts: Occupancy index, list of occupancy snapshots
+       Returns:  Number of slots in the index after appending
+    """
+    if len(occupancy_data) == 0: return index['slots']
+    slots = []
+    rows = np.zeros((len(occupancy_data), len(index['apartments'])), dtype=np.int32)
+    mapping = index['apartments_mapping']
+    for i in range(0, len(occupancy_data)):
+        s = occupancy_data[i]
+        slot = timestamp_to_slot(index, s['Timestamp'], exact=True)
+        if slot < index['slots'] or (len(slots) > 0 and slot <= slots[-1]):
+            raise ValueError('Snapshot {} is out of order'.format(s['Timestamp']))
+        slots.append(slot)
+        for apt, occupied in s['Occupancy'].items():
+            rows[i, mapping[apt]] = occupied
+
+    new_slots = slots[-1] + 1
+    _ensure_capacity(index, new_slots)
+    last = index['slots']
+    dense = np.zeros((new_slots - last, rows.shape[1]), dtype=np.int32)
+    dense[np.asarray(slots) - last] = rows
+    a_cs = index['apartment_cumsum']
+    a_cs[last + 1:new_slots + 1] = a_cs[last] + np.cumsum(dense, axis=0)
+    g_cs = index['group_cumsum']
+    g_cs[last + 1:new_slots + 1] = g_cs[last] + np.cumsum(dense @ index['membership'], axis=0)
+    index['slots'] = new_slots
+    return new_slots
+
+def append_occupancy_snapshot(index, snapshot):
+    """Appends a single occupancy snapshot ({'Occupancy': {...}, 'Timestamp': str}) to the index
+       Accepts: Occupancy index, occupancy snapshot
+       Returns:  Number of slots in the index after appending
+    """
+    return append_occupancy_snapshots(index, [snapshot])
+
+def timestamp_to_slot(index, timestamp, exact=False):
+    """Converts a timestamp into a slot number of the index, rounding down to the slot start
+       Accepts: Occupancy index, timestamp (string or datetime), exact (boolean, True to reject timestamps not aligned to the index step)
+       Returns:  Integer slot
+    """
+    offset = parse_timestamp(timestamp) - index['start']
+    slot = offset // index['step']
+    if exact and offset % index['step'] != timedelta(0):
+        raise ValueError('Timestamp {} is not aligned to step {}'.format(timestamp, index['step']))
+    return slot
+
+def _slot_range(index, start, end):
+    """ Helper method of the query methods, converts [start, end) timestamps to clipped slot bounds
+        Accepts: Occupancy index, start and end timestamps (None for index bounds)
+        Returns:  Tuple of slot bounds (from, to)
+    """
+    t0 = 0 if start is None else timestamp_to_slot(index, start)
+    t1 = index['slots'] if end is None else timestamp_to_slot(index, end)
+    t0 = min(max(t0, 0), index['slots'])
+    t1 = min(max(t1, t0), index['slots'])
+    return t0, t1
+
+def query_occupancy(index, start=None, end=None, group='ALL'):
+    """Counts occupied apartment-slots of a group of apartments in the time range [start, end) in O(1)
+       Accepts: Occupancy index, start and end timestamps (None for index bounds), group name (see build_apartment_groups) or apartment label
+       Returns:  Integer number of occupied apartment-slots
+    """
+    t0, t1 = _slot_range(index, start, end)
+    if group in index['groups_mapping']:
+        g = index['groups_mapping'][group]
+        return int(index['group_cumsum'][t1, g] - index['group_cumsum'][t0, g])
+    a = index['apartments_mapping'][group]
+    return int(index['apartment_cumsum'][t1, a] - index['apartment_cumsum'][t0, a])
+
+def query_occupancy_rate(index, start=None, end=None, group='ALL'):
+    """Calculates the occupancy rate of a group of apartments in the time range [start, end) in O(1)
+       Accepts: Occupancy index, start and end timestamps (None for index bounds), group name or apartment label
+       Returns:  Double occupancy rate (0-1)
+    """
+    t0, t1 = _slot_range(index, start, end)
+    size = len(index['groups'][group]) if group in index['groups'] else 1
+    if t1 == t0: return 0.0
+    return query_occupancy(index, start, end, group) / float((t1 - t0) * size)
+
+def _daily_window_slots(index, from_hour, to_hour, start, end, weekday):
+    """ Helper method of the daily window queries, builds slot bounds of a time-of-day window for every day in [start, end)
+        Accepts: Occupancy index, window hours [from_hour, to_hour), start and end timestamps, weekday (0-6, Monday is 0, None for every day)
+        Returns:  Numpy arrays of window start slots and end slots
+    """
+    t0, t1 = _slot_range(index, start, end)
+    first_day = (index['start'] + t0 * index['step']).replace(hour=0, minute=0, second=0, microsecond=0)
+    last_time = index['start'] + t1 * index['step']
+    starts = []
+    ends = []
+    day = first_day
+    while day < last_time:
+        if weekday is None or day.weekday() == weekday:
+            w0 = timestamp_to_slot(index, day + timedelta(hours=from_hour))
+            w1 = timestamp_to_slot(index, day + timedelta(hours=to_hour))
+            starts.append(min(max(w0, t0), t1))
+            ends.append(min(max(w1, t0), t1))
+        day = day + timedelta(days=1)
+    return np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+
+def query_daily_window_occupancy_rate(index, from_hour, to_hour, start=None, end=None, group='ALL', weekday=None):
+    """Calculates the occupancy rate of a group of apartments inside a daily time window (e.g. 18-22h) over a range of days, O(1) per day
+       Accepts: Occupancy index, window hours [from_hour, to_hour), start and end timestamps (None for index bounds), group name or apartment label, weekday (0-6, Monday is 0, None for every day)
+       Returns:  Double occupancy rate (0-1)
+    """
+    w0, w1 = _daily_window_slots(index, from_hour, to_hour, start, end, weekday)
+    if group in index['groups_mapping']:
+        cs = index['group_cumsum'][:, index['groups_mapping'][group]]
+        size = len(index['groups'][group])
+    else:
+        cs = index['apartment_cumsum'][:, index['apartments_mapping'][group]]
+        size = 1
+    slots = int(np.sum(w1 - w0))
+    if slots == 0: return 0.0
+    return float(np.sum(cs[w1] - cs[w0])) / (slots * size)
+
+def busiest_apartments(index, start=None, end=None, group='ALL', top=5, weekday=None):
+    """Finds the most occupied apartments of a group in the time range [start, end), optionally only on a given weekday
+       Accepts: Occupancy index, start and end timestamps (None for index bounds), group name, number of apartments to return, weekday (0-6, Monday is 0, None for every day)
+       Returns:  List of tuples (apartment label, occupied slots), most occupied first
+    """
+    cs = index['apartment_cumsum']
+    if weekday is None:
+        t0, t1 = _slot_range(index, start, end)
+        counts = cs[t1] - cs[t0]
+    else:
+        w0, w1 = _daily_window_slots(index, 0, 24, start, end, weekday)
+        counts = np.sum(cs[w1] - cs[w0], axis=0)
+    columns = np.asarray(index['groups'][group])
+    order = columns[np.argsort(-counts[columns], kind='stable')][:top]
+    return [(index['apartments'][a], int(counts[a])) for a in order]
+
+def busiest_apartments_per_group(index, start=None, end=None, prefix='SIDE_', top=5, weekday=None):
+    """Finds the most occupied apartments for every group whose name starts with prefix (e.g. per building side or per floor)
+       Accepts: Occupancy index, start and end timestamps, group name prefix, number of apartments per group, weekday (0-6, Monday is 0, None for every day)
+       Returns:  Dictionary of group name and list of tuples (apartment label, occupied slots)
+    """
+    busiest = {}
+    for g in index['group_names']:
+        if g.startswith(prefix):
+            busiest[g] = busiest_apartments(index, start, end, g, top, weekday)
+    return busiest
@@ -0,0 +1,232 @@
+import math
+import time
+import numpy as np
+from collections import Counter
+from joblib import Parallel, delayed
+from numpy.lib.stride_tricks import sliding_window_view
+from Helpers import most_frequent
+
+def build_hourly_paths(all_data, snapshots_per_hour=6):
+    """Builds hourly tenant paths for every beacon in one pass over the data, with the same aggregation as aggregate_tenant_hourly_positions (most frequent apartment per hour, 'OUTSIDE' when not seen)
+       Accepts: List of positioning snapshots, number of snapshots per hour (6 for 10 minutes data)
+       Returns:  Dictionary of beacon Mac address and list of hourly apartments
+    """
+    hours = len(all_data) // snapshots_per_hour
+    per_hour = {}
+    for i in range(0, hours * snapshots_per_hour):
+        h = i // snapshots_per_hour
+        for beacon_mac, b in all_data[i]['Beacons'].items():
+            if beacon_mac not in per_hour: per_hour[beacon_mac] = {}
+            if h not in per_hour[beacon_mac]: per_hour[beacon_mac][h] = []
+            per_hour[beacon_mac][h].append(b['Appartement'].replace('FLOOR', 'F').replace('APT', 'A'))
+    paths = {}
+    for beacon_mac, apts_per_hour in per_hour.items():
+        paths[beacon_mac] = [most_frequent(apts_per_hour[h]) if h in apts_per_hour else 'OUTSIDE' for h in range(0, hours)]
+    return paths
+
+def encode_paths(paths, collapse_repeats=False):
+    """Integer-encodes tenant paths over a shared vocabulary of apartments
+       Accepts: Dictionary of beacon Mac address and list of apartments, collapse_repeats (boolean, True to merge consecutive stays in the same apartment into one step)
+       Returns:  List of beacon Mac addresses, list of int32 numpy arrays (one sequence per beacon), vocabulary (list of apartments)
+    """
+    vocabulary = []
+    mapping = {}
+    beacons = []
+    sequences = []
+    for beacon_mac, apts in paths.items():
+        codes = []
+        for a in apts:
+            if a not in mapping:
+                mapping[a] = len(vocabulary)
+                vocabulary.append(a)
+            codes.append(mapping[a])
+        codes = np.asarray(codes, dtype=np.int32)
+        if collapse_repeats and len(codes) > 1:
+            codes = codes[np.concatenate(([True], codes[1:] != codes[:-1]))]
+        beacons.append(beacon_mac)
+        sequences.append(codes)
+    return beacons, sequences, vocabulary
+
+def decode_pattern(code, length, vocabulary):
+    """Decodes an integer pattern code (base len(vocabulary) digits) back into apartments
+       Accepts: Integer code, pattern length, vocabulary
+       Returns:  List of apartments
+    """
+    base = len(vocabulary)
+    apts = []
+    for i in range(0, length):
+        code, digit = divmod(int(code), base)
+        apts.append(vocabulary[digit])
+    return apts[::-1]
+
+def _max_pattern_length(base, reserved=1):
+    """ Helper method of the mining methods, longest pattern whose code fits into int64
+        Accepts: Vocabulary size, multiplier reserved for extra key bits
+        Returns:  Integer length
+    """
+    return int(math.floor((63 - math.log2(reserved)) / math.log2(max(base, 2))))
+
+def _ngram_codes(sequence, k, base):
+    """ Helper method of the mining methods, encodes every contiguous k-gram of a sequence into one int64 code
+        Accepts: Int sequence (numpy array), k, vocabulary size
+        Returns:  Numpy array of int64 codes
+    """
+    powers = base ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    return sliding_window_view(sequence.astype(np.int64), k, axis=-1) @ powers
+
+def _chunk_ngrams(sequences, k, base, frequent):
+    """ Helper method of mine_frequent_subsequences (run in parallel over beacon chunks), counts k-grams whose (k-1)-prefix and (k-1)-suffix are both frequent
+        Accepts: List of int sequences, k, vocabulary size, sorted numpy array of frequent (k-1)-gram codes (None for k=1)
+        Returns:  Numpy array of codes unique per beacon, numpy array of all code occurrences
+    """
+    unique = []
+    occurrences = []
+    suffix_base = base ** (k - 1)
+    for s in sequences:
+        if len(s) < k: continue
+        codes = _ngram_codes(s, k, base)
+        if frequent is not None:
+            keep = np.isin(codes // base, frequent) & np.isin(codes % suffix_base, frequent)
+            codes = codes[keep]
+        occurrences.append(codes)
+        unique.append(np.unique(codes))
+    if len(unique) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(unique), np.concatenate(occurrences)
+
+def mine_frequent_subsequences(paths, min_support=0.05, min_length=2, max_length=8, collapse_repeats=True, ignore=('OUTSIDE',), n_jobs=-1):
+    """Finds frequent apartment sub-sequences (contiguous) across all beacons. Patterns are grown level by level in a prefix tree of integer codes, a (k+1)-pattern is only counted if its k-prefix and k-suffix reached the support threshold.
+       Accepts: Dictionary of beacon Mac address and list of hourly apartments, min_support (beacons containing a pattern, integer or fraction of beacons), min_length and max_length of patterns, collapse_repeats (boolean, True to merge consecutive stays), ignore (patterns made only of these apartments are not reported), n_jobs (joblib workers)
+       Returns:  List of dictionaries {'pattern', 'length', 'support', 'occurrences'}, sorted by support
+    """
+    beacons, sequences, vocabulary = encode_paths(paths, collapse_repeats)
+    base = len(vocabulary)
+    if base == 0: return []
+    if isinstance(min_support, float) and min_support <= 1:
+        min_support = max(1, int(math.ceil(min_support * len(beacons))))
+    max_length = min(max_length, _max_pattern_length(base))
+    chunks = [c for c in np.array_split(np.arange(len(sequences)), max(1, min(len(sequences), 4 * (n_jobs if n_jobs > 0 else 8)))) if len(c) > 0]
+    chunks = [[sequences[i] for i in c] for c in chunks]
+
+    patterns = []
+    frequent = None
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for k in range(1, max_length + 1):
+            results = parallel(delayed(_chunk_ngrams)(chunk, k, base, frequent) for chunk in chunks)
+            unique = np.concatenate([r[0] for r in results])
+            occurrences = np.concatenate([r[1] for r in results])
+            codes, support = np.unique(unique, return_counts=True)
+            keep = support >= min_support
+            codes = codes[keep]
+            support = support[keep]
+            if len(codes) == 0: break
+            if k >= min_length:
+                all_codes, all_counts = np.unique(occurrences, return_counts=True)
+                counts = all_counts[np.searchsorted(all_codes, codes)]
+                for c, s, o in zip(codes, support, counts):
+                    pattern = decode_pattern(c, k, vocabulary)
+                    if all(a in ignore for a in pattern): continue
+                    patterns.append({'pattern': pattern, 'length': k, 'support': int(s), 'occurrences': int(o)})
+            frequent = codes
+    patterns.sort(key=lambda p: (-p['support'], -p['length']))
+    return patterns
+
+def _beacon_routines(sequence, base, min_days, min_length, max_length, hours_per_day):
+    """ Helper method of mine_daily_routines, finds closed time-aligned routines of one beacon (a routine is an apartment sequence starting at the same hour on at least min_days days)
+        Accepts: Int sequence of hourly apartments, vocabulary size, min_days, min_length and max_length of routines, slots per day
+        Returns:  List of tuples (start hour, length, code, days)
+    """
+    days = len(sequence) // hours_per_day
+    if days < min_days: return []
+    day_matrix = sequence[:days * hours_per_day].reshape(days, hours_per_day)
+    levels = []
+    for k in range(1, max_length + 1):
+        codes = _ngram_codes(day_matrix, k, base)
+        # Key combines the routine code with its start hour
+        keys = codes * hours_per_day + np.arange(codes.shape[1], dtype=np.int64)
+        keys, support = np.unique(keys, return_counts=True)
+        keep = support >= min_days
+        if not keep.any(): break
+        levels.append((keys[keep], support[keep]))
+
+    routines = []
+    for k in range(1, len(levels) + 1):
+        if k < min_length: continue
+        keys, support = levels[k - 1]
+        extended = set()
+        if k < len(levels):
+            ext_keys, ext_support = levels[k]
+            ext_codes, ext_hours = np.divmod(ext_keys, hours_per_day)
+            # Right extension keeps the start hour, left extension starts one hour earlier
+            right = (ext_codes // base) * hours_per_day + ext_hours
+            left = (ext_codes % base ** k) * hours_per_day + ext_hours + 1
+            extended = set(zip(right.tolist(), ext_support.tolist())) | set(zip(left.tolist(), ext_support.tolist()))
+        for key, s in zip(keys.tolist(), support.tolist()):
+            if (key, s) in extended: continue
+            code, hour = divmod(key, hours_per_day)
+            routines.append((hour, k, code, s))
+    return routines
+
+def _chunk_routines(beacons, sequences, base, min_days, min_length, max_length, hours_per_day):
+    """ Helper method of mine_daily_routines (run in parallel over beacon chunks)
+        Accepts: List of beacon Mac addresses, list of int sequences, mining parameters (see mine_daily_routines)
+        Returns:  Dictionary of beacon Mac address and list of routine tuples
+    """
+    routines = {}
+    for b, s in zip(beacons, sequences):
+        r = _beacon_routines(s, base, min_days, min_length, max_length, hours_per_day)
+        if len(r) > 0: routines[b] = r
+    return routines
+
+def mine_daily_routines(paths, min_days=3, min_length=2, max_length=8, hours_per_day=24, ignore=('OUTSIDE',), n_jobs=-1):
+    """Finds recurring daily routines of every beacon: apartment sequences that start at the same hour on at least min_days days. Only closed routines are reported (no longer routine containing it recurs on as many days).
+       Accepts: Dictionary of beacon Mac address and list of hourly apartments, min_days, min_length and max_length of routines in hours, slots per day, ignore (routines made only of these apartments are not reported), n_jobs (joblib workers)
+       Returns:  Dictionary of beacon Mac address and list of dictionaries {'start_hour', 'end_hour', 'apartments', 'days'}, sorted by days
+    """
+    beacons, sequences, vocabulary = encode_paths(paths)
+    base = len(vocabulary)
+    if base == 0: return {}
+    max_length = min(max_length, hours_per_day, _max_pattern_length(base, hours_per_day))
+    chunks = [c for c in np.array_split(np.arange(len(sequences)), max(1, min(len(sequences), 4 * (n_jobs if n_jobs > 0 else 8)))) if len(c) > 0]
+    results = Parallel(n_jobs=n_jobs)(delayed(_chunk_routines)([beacons[i] for i in c], [sequences[i] for i in c], base, min_days, min_length, max_length, hours_per_day) for c in chunks)
+
+    routines = {}
+    for r in results:
+        for beacon_mac, found in r.items():
+            decoded = []
+            for (hour, k, code, days) in found:
+                apts = decode_pattern(code, k, vocabulary)
+                if all(a in ignore for a in apts): continue
+                decoded.append({'start_hour': hour, 'end_hour': hour + k, 'apartments': apts, 'days': days})
+            if len(decoded) > 0:
+                routines[beacon_mac] = sorted(decoded, key=lambda x: (-x['days'], -len(x['apartments']), x['start_hour']))
+    return routines
+
+def summarize_routines(routines, min_beacons=2):
+    """Finds routines shared by several beacons (same start hour and apartments)
+       Accepts: Dictionary of beacon routines (see mine_daily_routines), minimal number of beacons
+       Returns:  List of dictionaries {'start_hour', 'end_hour', 'apartments', 'beacons'}, sorted by beacons
+    """
+    shared = Counter()
+    for found in routines.values():
+        for r in found:
+            shared[(r['start_hour'], tuple(r['apartments']))] += 1
+    return [{
+        'start_hour': hour,
+        'end_hour': hour + len(apts),
+        'apartments': list(apts),
+        'beacons': n
+    } for (hour, apts), n in shared.most_common() if n >= min_beacons]
+
+def measure_pattern_mining(paths, n_jobs=-1, **kwargs):
+    """Measures time taken to mine frequent sub-sequences and daily routines
+       Accepts: Dictionary of beacon Mac address and list of hourly apartments, n_jobs (joblib workers), keyword arguments of mine_frequent_subsequences
+       Returns:  Tuple of frequent patterns, daily routines
+    """
+    start = time.time()
+    patterns = mine_frequent_subsequences(paths, n_jobs=n_jobs, **kwargs)
+    middle = time.time()
+    routines = mine_daily_routines(paths, n_jobs=n_jobs)
+    stop = time.time()
+    print('Mined {} frequent patterns in {} seconds and routines of {} beacons in {} seconds'.format(len(patterns), middle - start, len(routines), stop - middle))
+    return patterns, routines
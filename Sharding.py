@@ -0,0 +1,232 @@
+import time
+import json
+import zlib
+import numpy as np
+import networkx as nx
+from collections import Counter
+from functools import reduce
+from joblib import Parallel, delayed
+from OccupancyIndex import parse_timestamp
+from PatternMining import build_hourly_paths
+from Helpers import build_apartments_labels, calculate_levenshtein_distance
+
+def shard_key(beacon_mac, record, shard_by='beacon', shards=4):
+    """Computes the shard key of one beacon record
+       Accepts: Beacon Mac address, beacon record, shard_by ('beacon' for a stable beacon hash, 'datacenter' for the DC of the strongest AP, e.g. 'DC1', 'side' for the building side tag of the apartment, '_B' or '_U'), number of shards (beacon hash only)
+       Returns:  Shard key, None if the record has no key (no APs or outside the building)
+    """
+    if shard_by == 'beacon':
+        return zlib.crc32(beacon_mac.encode()) % shards
+    if shard_by == 'datacenter':
+        if len(record['APs']) == 0: return None
+        return record['APs'][int(np.argmax(record['RSSIs']))].split('_')[0]
+    if shard_by == 'side':
+        apt = record['Appartement']
+        return apt[-2:] if apt.startswith('APT') else None
+    raise ValueError('Unknown shard_by: {}'.format(shard_by))
+
+def _count_shard_keys(all_data, shard_by='beacon', shards=4):
+    """ Helper method of assign_home_shards, counts the shard keys of every beacon's records
+        Accepts: List of positioning snapshots, shard_by (see shard_key), number of shards (beacon hash only)
+        Returns:  Dictionary of beacon Mac address and shard key Counter
+    """
+    keys = {}
+    for s in all_data:
+        for beacon_mac, b in s['Beacons'].items():
+            if beacon_mac not in keys: keys[beacon_mac] = Counter()
+            if shard_by == 'beacon' and len(keys[beacon_mac]) > 0: continue
+            k = shard_key(beacon_mac, b, shard_by, shards)
+            if k is not None: keys[beacon_mac][k] += 1
+    return keys
+
+def _home_shards(key_counts):
+    """ Helper method of assign_home_shards, picks the most frequent shard key of every beacon over several key counts
+        Accepts: List of dictionaries of beacon Mac address and shard key Counter (see _count_shard_keys)
+        Returns:  Dictionary of beacon Mac address and shard key
+    """
+    keys = {}
+    for counts in key_counts:
+        for beacon_mac, c in counts.items():
+            if beacon_mac not in keys: keys[beacon_mac] = Counter()
+            keys[beacon_mac].update(c)
+    return {beacon_mac: c.most_common(1)[0][0] if len(c) > 0 else 'OUTSIDE' for beacon_mac, c in keys.items()}
+
+def assign_home_shards(datasets, shard_by='beacon', shards=4):
+    """Assigns every beacon to a single home shard, the most frequent shard key of its records over all datasets (e.g. the DC it is mostly seen from), so a beacon's records are never split across shards. Beacons with no keyed record go to the 'OUTSIDE' shard.
+       Accepts: List of lists of positioning snapshots, shard_by (see shard_key), number of shards (beacon hash only)
+       Returns:  Dictionary of beacon Mac address and shard key
+    """
+    return _home_shards([_count_shard_keys(data, shard_by, shards) for data in datasets])
+
+def shard_snapshots(all_data, shard_by='beacon', shards=4, homes=None):
+    """Splits raw positioning snapshots into independent shards, all records of a beacon go to its home shard. Every shard keeps every timestamp (possibly with no beacons), so hourly windows stay aligned across shards.
+       Accepts: List of positioning snapshots, shard_by (see shard_key), number of shards (beacon hash only), dictionary of beacon home shards (computed from all_data if None, see assign_home_shards)
+       Returns:  Dictionary of shard key and list of positioning snapshots
+    """
+    if homes is None:
+        homes = assign_home_shards([all_data], shard_by, shards)
+    sharded = {k: [] for k in set(homes.values())}
+    for s in all_data:
+        split = {k: {} for k in sharded}
+        for beacon_mac, b in s['Beacons'].items():
+            split[homes[beacon_mac]][beacon_mac] = b
+        for k in sharded:
+            sharded[k].append({'Timestamp': s['Timestamp'], 'Beacons': split[k]})
+    return sharded
+
+def _day_similarity(apts, hours_per_day=24):
+    """ Helper method of process_shard, sums percentage and Levenshtein similarity of every two consecutive days of a path (as calculate_path_graphs_weekly_similarity)
+        Accepts: List of hourly apartments, slots per day
+        Returns:  Dictionary with summed '%sim', summed 'levenshtein' and number of compared day 'pairs'
+    """
+    days = [apts[i:i + hours_per_day] for i in range(0, len(apts) - hours_per_day + 1, hours_per_day)]
+    similarity = {'%sim': 0.0, 'levenshtein': 0.0, 'pairs': 0}
+    for i in range(0, len(days) - 1):
+        d1 = days[i]
+        d2 = days[i + 1]
+        similarity['%sim'] += len(set(d1) & set(d2)) / float(len(set(d1) | set(d2))) * 100
+        similarity['levenshtein'] += calculate_levenshtein_distance(d1, d2)
+        similarity['pairs'] += 1
+    return similarity
+
+def process_shard(snapshots, snapshots_per_hour=6, hours_per_day=24):
+    """Processes one shard into a partial result: hourly occupancy, building transitions and per-beacon daily similarity. Partials are merged with merge_partials. Every beacon lives in one shard (see assign_home_shards), so merged results equal unsharded ones.
+       Accepts: List of positioning snapshots, number of snapshots per hour, slots per day
+       Returns:  Dictionary partial result
+    """
+    apartments = build_apartments_labels()
+    columns = {a.replace('FLOOR', 'F').replace('APT', 'A'): i for i, a in enumerate(apartments)}
+    paths = build_hourly_paths(snapshots, snapshots_per_hour)
+    hours = len(snapshots) // snapshots_per_hour
+    occupancy = np.zeros((hours, len(apartments)), dtype=np.int8)
+    edges = Counter()
+    stays = Counter()
+    similarity = {}
+    for beacon_mac, apts in paths.items():
+        previous = 'OUTSIDE'
+        for h in range(0, len(apts)):
+            apt = apts[h]
+            if apt in columns: occupancy[h, columns[apt]] = 1
+            if apt != 'OUTSIDE':
+                stays[apt] += 1
+                if previous != 'OUTSIDE' and previous != apt: edges[(previous, apt)] += 1
+            previous = apt
+        similarity[beacon_mac] = _day_similarity(apts, hours_per_day)
+    return {
+        'apartments': apartments,
+        'timestamps': [snapshots[h * snapshots_per_hour]['Timestamp'] for h in range(0, hours)],
+        'occupancy': occupancy,
+        'edges': edges,
+        'stays': stays,
+        'similarity': similarity
+    }
+
+def merge_partials(a, b):
+    """Associative (and commutative) merge of two partial results: occupancy is OR-ed per timestamp, transitions and stays are summed, similarity sums of beacons seen in both are added
+       Accepts: Two partial results (see process_shard)
+       Returns:  Merged partial result
+    """
+    timestamps = sorted(set(a['timestamps']) | set(b['timestamps']), key=parse_timestamp)
+    rows = {t: i for i, t in enumerate(timestamps)}
+    occupancy = np.zeros((len(timestamps), len(a['apartments'])), dtype=np.int8)
+    for p in [a, b]:
+        idx = [rows[t] for t in p['timestamps']]
+        occupancy[idx] = np.maximum(occupancy[idx], p['occupancy'])
+    similarity = dict(a['similarity'])
+    for beacon_mac, s in b['similarity'].items():
+        if beacon_mac in similarity:
+            similarity[beacon_mac] = {k: similarity[beacon_mac][k] + s[k] for k in s}
+        else:
+            similarity[beacon_mac] = s
+    return {
+        'apartments': a['apartments'],
+        'timestamps': timestamps,
+        'occupancy': occupancy,
+        'edges': a['edges'] + b['edges'],
+        'stays': a['stays'] + b['stays'],
+        'similarity': similarity
+    }
+
+def finalize_partial(partial, min_weight=0):
+    """Turns a merged partial result into outputs: occupancy snapshots (occupancy dataset schema), building transitions graph and per-beacon similarity with worthy beacons (as calculate_path_graphs_weekly_similarity, without cosine similarity)
+       Accepts: Merged partial result, minimal transition weight kept in the graph
+       Returns:  Dictionary {'occupancy', 'graph', 'similarity'}
+    """
+    occupancy = []
+    for i in range(0, len(partial['timestamps'])):
+        occupancy.append({
+            'Occupancy': dict(zip(partial['apartments'], partial['occupancy'][i].tolist())),
+            'Timestamp': partial['timestamps'][i]
+        })
+
+    G = nx.DiGraph()
+    for apt, n in partial['stays'].items():
+        G.add_node(apt, stays=n)
+    for (fromN, toN), w in partial['edges'].items():
+        if w > min_weight: G.add_edge(fromN, toN, weight=w)
+
+    similarity = {}
+    for beacon_mac, s in partial['similarity'].items():
+        if s['pairs'] == 0: continue
+        similarity[beacon_mac] = {'average_%': s['%sim'] / s['pairs'], 'average_Levenshtein': s['levenshtein'] / s['pairs'], 'pairs': s['pairs']}
+    beacons = sorted(similarity.keys())
+    for limit in [60, 70, 80, 90]:
+        worthy = [b for b in beacons if similarity[b]['average_%'] > limit]
+        similarity['worthy_beacons_{}_num'.format(limit)] = len(worthy)
+        similarity['worthy_beacons_{}'.format(limit)] = worthy
+    return {'occupancy': occupancy, 'graph': G, 'similarity': similarity}
+
+def run_sharded(all_data, shard_by='beacon', shards=4, n_jobs=-1, min_weight=0):
+    """Shards positioning data, processes every shard in its own worker and merges partial results with an associative reduce
+       Accepts: List of positioning snapshots (or list of lists, e.g. one per month, processed as separate shards), shard_by (see shard_key), number of shards (beacon hash only), n_jobs (joblib workers), minimal transition weight kept in the graph
+       Returns:  Dictionary {'occupancy', 'graph', 'similarity'} (see finalize_partial)
+    """
+    start = time.time()
+    datasets = all_data if len(all_data) > 0 and isinstance(all_data[0], list) else [all_data]
+    homes = assign_home_shards(datasets, shard_by, shards)
+    shard_list = []
+    for data in datasets:
+        shard_list.extend(shard_snapshots(data, shard_by, shards, homes).values())
+    sharded = time.time()
+    partials = Parallel(n_jobs=n_jobs)(delayed(process_shard)(s) for s in shard_list)
+    processed = time.time()
+    result = finalize_partial(reduce(merge_partials, partials), min_weight)
+    print('Sharded into {} shards in {} seconds, processed in {} seconds, merged in {} seconds'.format(len(shard_list), sharded - start, processed - sharded, time.time() - processed))
+    return result
+
+def _load_shard_keys(path, shard_by='beacon', shards=4):
+    """ Helper method of run_sharded_from_files, counts the shard keys of every beacon in one raw positioning data file
+        Accepts: Path to raw positioning data, shard_by (see shard_key), number of shards (beacon hash only)
+        Returns:  Dictionary of beacon Mac address and shard key Counter
+    """
+    with open(path) as json_file:
+        return _count_shard_keys(json.load(json_file), shard_by, shards)
+
+def _process_file_shard(path, beacons):
+    """ Helper method of run_sharded_from_files, loads one raw positioning data file and processes the records of one shard's beacons, keeping every timestamp
+        Accepts: Path to raw positioning data, set of beacon Mac addresses of the shard
+        Returns:  Dictionary partial result (see process_shard)
+    """
+    with open(path) as json_file:
+        data = json.load(json_file)
+    snapshots = [{'Timestamp': s['Timestamp'], 'Beacons': {m: b for m, b in s['Beacons'].items() if m in beacons}} for s in data]
+    del data
+    return process_shard(snapshots)
+
+def run_sharded_from_files(paths, shard_by='beacon', shards=4, n_jobs=-1, min_weight=0):
+    """Runs sharded processing over several raw positioning data files (e.g. one per month). Files are only read by workers: a first pass counts shard keys per file to assign home shards, then every (file, shard) is loaded, filtered and processed by its own worker, so the parent only holds beacon shard keys and partial results.
+       Accepts: List of paths to raw positioning data, shard_by (see shard_key), number of shards (beacon hash only), n_jobs (joblib workers), minimal transition weight kept in the graph
+       Returns:  Dictionary {'occupancy', 'graph', 'similarity'} (see finalize_partial)
+    """
+    start = time.time()
+    homes = _home_shards(Parallel(n_jobs=n_jobs)(delayed(_load_shard_keys)(path, shard_by, shards) for path in paths))
+    shard_beacons = {}
+    for beacon_mac, k in homes.items():
+        if k not in shard_beacons: shard_beacons[k] = set()
+        shard_beacons[k].add(beacon_mac)
+    sharded = time.time()
+    partials = Parallel(n_jobs=n_jobs)(delayed(_process_file_shard)(path, beacons) for path in paths for beacons in shard_beacons.values())
+    processed = time.time()
+    result = finalize_partial(reduce(merge_partials, partials), min_weight)
+    print('Sharded {} files into {} shards in {} seconds, processed in {} seconds, merged in {} seconds'.format(len(paths), len(shard_beacons), sharded - start, processed - sharded, time.time() - processed))
+    return result
@@ -0,0 +1,163 @@
+import time
+import json
+import numpy as np
+from datetime import datetime as dt
+from OccupancyIndex import parse_timestamp
+
+def load_access_points(path):
+    """Loads access points names and 3D coordinates
+       Accepts: Path to access points data (e.g. datasets/access_points/access_points.json)
+       Returns:  List of AP names, numpy array of AP coordinates (n x 3)
+    """
+    with open(path) as json_file:
+        aps = json.load(json_file)
+        names = list(aps.keys())
+        return names, np.asarray([aps[n] for n in names], dtype=np.float64)
+
+def build_filter_state(ap_names, method='kalman', alpha=0.3, period=10.0, rssi_noise=(0.05, 16.0), location_noise=(0.005, 4.0), capacity=64):
+    """Builds a batched filter state for smoothing RSSIs per (beacon, AP) and 3D location per beacon
+       Accepts: List of AP names, method ('kalman' or 'exponential'), alpha (exponential smoothing factor per period), period in minutes (snapshot interval alpha refers to), rssi_noise and location_noise (tuples of Kalman process noise variance per minute and measurement noise variance), initial beacon capacity
+       Returns:  Dictionary filter state holding numpy state arrays for all beacons
+    """
+    if method not in ['kalman', 'exponential']:
+        raise ValueError('Unknown filtering method: {}'.format(method))
+    return {
+        'method': method,
+        'alpha': alpha,
+        'period': period,
+        'rssi_noise': rssi_noise,
+        'location_noise': location_noise,
+        'ap_names': list(ap_names),
+        'aps_mapping': {ap_names[i]: i for i in range(0, len(ap_names))},
+        'beacons_mapping': {},
+        'beacons': 0,
+        'snapshots': 0,
+        # Filtered values, estimate variances (Kalman only) and masks of values observed at least once
+        'rssi': np.zeros((capacity, len(ap_names)), dtype=np.float64),
+        'rssi_var': np.zeros((capacity, len(ap_names)), dtype=np.float64),
+        'rssi_seen': np.zeros((capacity, len(ap_names)), dtype=bool),
+        'location': np.zeros((capacity, 3), dtype=np.float64),
+        'location_var': np.zeros((capacity, 3), dtype=np.float64),
+        'location_seen': np.zeros((capacity, 3), dtype=bool),
+        # Time (seconds) every beacon row was last updated, smoothing weights and Kalman process noise scale with the time elapsed since
+        'last_time': np.zeros(capacity, dtype=np.float64)
+    }
+
+def _beacon_rows(state, beacon_macs):
+    """ Helper method of update_filter_state, maps beacons to state rows, registering new beacons and growing state arrays by doubling
+        Accepts: Filter state, list of beacon Mac addresses
+        Returns:  Numpy array of state rows
+    """
+    mapping = state['beacons_mapping']
+    for b in beacon_macs:
+        if b not in mapping:
+            mapping[b] = state['beacons']
+            state['beacons'] += 1
+    capacity = state['rssi'].shape[0]
+    if state['beacons'] > capacity:
+        while capacity < state['beacons']:
+            capacity *= 2
+        for key in ['rssi', 'rssi_var', 'rssi_seen', 'location', 'location_var', 'location_seen', 'last_time']:
+            old = state[key]
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:old.shape[0]] = old
+            state[key] = new
+    return np.asarray([mapping[b] for b in beacon_macs], dtype=np.int64)
+
+def _smooth(state, key, rows, z, observed, noise, elapsed):
+    """ Helper method of update_filter_state, runs one vectorized exponential smoothing (alpha decayed over the elapsed time) or scalar Kalman (random walk model) step on the observed entries
+        Accepts: Filter state, state key ('rssi' or 'location'), state rows, measurements matrix, observed mask, tuple of Kalman process noise variance per minute and measurement noise variance, numpy array of minutes elapsed since every row was last updated
+        Returns:  Numpy array of filtered values for the given rows
+    """
+    x = state[key][rows]
+    seen = state[key + '_seen'][rows]
+    first = observed & ~seen
+    update = observed & seen
+    if state['method'] == 'exponential':
+        # alpha applies per period, so old values weigh less the longer a beacon or AP was not observed
+        a = np.broadcast_to(1 - (1 - state['alpha']) ** (elapsed[:, None] / state['period']), x.shape)
+        x[update] = x[update] + a[update] * (z[update] - x[update])
+    else:
+        (q, r) = noise
+        p = state[key + '_var'][rows]
+        # Predict for every tracked entry over the time since its row was last updated, so uncertainty grows while a beacon or AP is not observed
+        p += np.where(seen, q * elapsed[:, None], 0.0)
+        k = p[update] / (p[update] + r)
+        x[update] = x[update] + k * (z[update] - x[update])
+        p[update] = (1 - k) * p[update]
+        p[first] = r
+        state[key + '_var'][rows] = p
+    x[first] = z[first]
+    state[key][rows] = x
+    state[key + '_seen'][rows] = seen | observed
+    return x
+
+def update_filter_state(state, snapshot):
+    """Incrementally updates the filter state with one positioning snapshot, all beacons of the snapshot are filtered in one batch
+       Accepts: Filter state, positioning snapshot ({'Timestamp': str, 'Beacons': {mac: {'APs', 'RSSIs', 'Location', ...}}})
+       Returns:  List of beacon Mac addresses, numpy arrays of filtered RSSIs (beacons x APs) and filtered locations (beacons x 3)
+    """
+    beacon_macs = list(snapshot['Beacons'].keys())
+    rows = _beacon_rows(state, beacon_macs)
+    aps_mapping = state['aps_mapping']
+    z_rssi = np.zeros((len(beacon_macs), len(aps_mapping)), dtype=np.float64)
+    observed_rssi = np.zeros(z_rssi.shape, dtype=bool)
+    z_location = np.zeros((len(beacon_macs), 3), dtype=np.float64)
+    observed_location = np.zeros(z_location.shape, dtype=bool)
+    for i in range(0, len(beacon_macs)):
+        b = snapshot['Beacons'][beacon_macs[i]]
+        cols = [aps_mapping[ap] for ap in b['APs'] if ap in aps_mapping]
+        rssis = [b['RSSIs'][j] for j in range(0, len(b['APs'])) if b['APs'][j] in aps_mapping]
+        z_rssi[i, cols] = rssis
+        observed_rssi[i, cols] = True
+        if b.get('Location'):
+            z_location[i] = b['Location']
+            observed_location[i] = True
+    now = (parse_timestamp(snapshot['Timestamp']) - dt(1970, 1, 1)).total_seconds()
+    elapsed = np.maximum(now - state['last_time'][rows], 0.0) / 60
+    rssi = _smooth(state, 'rssi', rows, z_rssi, observed_rssi, state['rssi_noise'], elapsed)
+    location = _smooth(state, 'location', rows, z_location, observed_location, state['location_noise'], elapsed)
+    state['last_time'][rows] = now
+    state['snapshots'] += 1
+    return beacon_macs, rssi, location
+
+def filter_snapshot(state, snapshot):
+    """Filters one positioning snapshot, returning a copy in the raw schema with smoothed 'RSSIs' and 'Location'. Works the same for historical replay and live streams.
+       Accepts: Filter state, positioning snapshot
+       Returns:  Filtered positioning snapshot
+    """
+    beacon_macs, rssi, location = update_filter_state(state, snapshot)
+    aps_mapping = state['aps_mapping']
+    filtered = {'Timestamp': snapshot['Timestamp'], 'Beacons': {}}
+    for i in range(0, len(beacon_macs)):
+        b = dict(snapshot['Beacons'][beacon_macs[i]])
+        b['RSSIs'] = [float(rssi[i, aps_mapping[ap]]) if ap in aps_mapping else r for ap, r in zip(b['APs'], b['RSSIs'])]
+        if b.get('Location'):
+            b['Location'] = location[i].tolist()
+        filtered['Beacons'][beacon_macs[i]] = b
+    return filtered
+
+def filter_snapshots(state, all_data):
+    """Filters a list (or any iterable, e.g. a live stream) of positioning snapshots in order
+       Accepts: Filter state, iterable of positioning snapshots
+       Returns:  Generator of filtered positioning snapshots
+    """
+    for snapshot in all_data:
+        yield filter_snapshot(state, snapshot)
+
+def measure_filter_throughput(path, ap_path, method='kalman', repeat=1):
+    """Measures filtering throughput of historical batch replay in snapshots per second
+       Accepts: Path to raw positioning data, path to access points data, method ('kalman' or 'exponential'), number of replays
+       Returns:  Double snapshots per second
+    """
+    with open(path) as json_file:
+        data = json.load(json_file)
+    ap_names, _ = load_access_points(ap_path)
+    state = build_filter_state(ap_names, method)
+    start = time.time()
+    for r in range(0, repeat):
+        for s in data:
+            update_filter_state(state, s)
+    took = time.time() - start
+    print('Filtered {} snapshots ({} beacons) in {} seconds, {} snapshots/s'.format(state['snapshots'], state['beacons'], took, state['snapshots'] / took))
+    return state['snapshots'] / took
@@ -0,0 +1,239 @@
+import time
+import numpy as np
+from SignalFiltering import load_access_points
+from Helpers import build_apartments_labels
+
+def build_floor_heights(ap_names, ap_coords):
+    """Builds floor height ranges from AP z coordinates (APs are mounted at the top of their floor, e.g. 'DC1_TOW_GND_AP1' at 2.5, 'DC1_TOW_1_AP1' at 5)
+       Accepts: List of AP names, numpy array of AP coordinates (n x 3)
+       Returns:  Dictionary of floor number and tuple (z bottom, z top)
+    """
+    tops = {}
+    for i in range(0, len(ap_names)):
+        floor = ap_names[i].split('_')[2]
+        floor = 0 if floor == 'GND' else int(floor)
+        tops[floor] = max(tops.get(floor, 0.0), float(ap_coords[i][2]))
+    heights = {}
+    bottom = 0.0
+    for floor in sorted(tops):
+        heights[floor] = (bottom, tops[floor])
+        bottom = tops[floor]
+    return heights
+
+def build_box_index(names, mins, maxs, cell_size=1.0):
+    """Builds a uniform grid index over axis-aligned boxes, each grid cell holds a padded row of candidate box ids
+       Accepts: List of box names, numpy arrays of box minimum and maximum corners (n x 3), grid cell size in meters
+       Returns:  Dictionary box index
+    """
+    mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+    maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+    if len(names) == 0:
+        return {'names': [], 'mins': mins, 'maxs': maxs, 'origin': np.zeros(3), 'cell_size': cell_size, 'shape': np.ones(3, dtype=np.int64), 'candidates': np.full((1, 1), -1, dtype=np.int64)}
+    origin = mins.min(axis=0)
+    shape = np.floor((maxs.max(axis=0) - origin) / cell_size).astype(np.int64) + 1
+    lo = np.floor((mins - origin) / cell_size).astype(np.int64)
+    hi = np.floor((maxs - origin) / cell_size).astype(np.int64)
+
+    counts = np.zeros(shape, dtype=np.int64)
+    for b in range(0, len(names)):
+        counts[lo[b, 0]:hi[b, 0] + 1, lo[b, 1]:hi[b, 1] + 1, lo[b, 2]:hi[b, 2] + 1] += 1
+    candidates = np.full(tuple(shape) + (max(int(counts.max()), 1),), -1, dtype=np.int64)
+    filled = np.zeros(shape, dtype=np.int64)
+    for b in range(0, len(names)):
+        cells = (slice(lo[b, 0], hi[b, 0] + 1), slice(lo[b, 1], hi[b, 1] + 1), slice(lo[b, 2], hi[b, 2] + 1))
+        # Every cell of the box gets the box id in its first free slot
+        slot = filled[cells]
+        sub = candidates[cells]
+        np.put_along_axis(sub, slot[..., None], b, axis=3)
+        candidates[cells] = sub
+        filled[cells] += 1
+
+    return {
+        'names': list(names),
+        'mins': mins,
+        'maxs': maxs,
+        'origin': origin,
+        'cell_size': cell_size,
+        'shape': shape,
+        'candidates': candidates.reshape(-1, candidates.shape[3])
+    }
+
+def query_box_index(index, points):
+    """Finds all boxes containing each point in one vectorized pass. Boxes are half-open [min, max), except on the outer bounds of the index.
+       Accepts: Box index, numpy array of points (n x 3)
+       Returns:  Numpy array of candidate box ids (n x k, -1 padded), boolean numpy array (n x k) of candidates containing the point
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if len(index['names']) == 0:
+        return np.full((len(points), 1), -1, dtype=np.int64), np.zeros((len(points), 1), dtype=bool)
+    cells = np.floor((points - index['origin']) / index['cell_size']).astype(np.int64)
+    inside_grid = np.all((cells >= 0) & (cells < index['shape']), axis=1)
+    cells = np.clip(cells, 0, index['shape'] - 1)
+    flat = np.ravel_multi_index(cells.T, tuple(index['shape']))
+    candidates = index['candidates'][flat]
+    candidates[~inside_grid] = -1
+    valid = candidates >= 0
+    safe = np.where(valid, candidates, 0)
+    mins = index['mins'][safe]
+    maxs = index['maxs'][safe]
+    upper = index['maxs'].max(axis=0)
+    p = points[:, None, :]
+    contained = np.all((p >= mins) & ((p < maxs) | ((p == maxs) & (maxs == upper))), axis=2)
+    return candidates, contained & valid
+
+def _split_floor_side(apts, xs, width):
+    """ Helper method of build_apartment_model, splits the x axis of one floor side between its apartments. Observed apartments span their observed x range (10th to 90th percentile), apartments with no observations are placed by apartment number in the gaps between observed ones (apartment numbers grow along x), and boundaries lie at the middle of every gap.
+        Accepts: List of (apartment number, apartment label) tuples, dictionary of apartment label and list of observed x coordinates, building width
+        Returns:  List of (apartment label, x minimum, x maximum) tuples ordered along x
+    """
+    apts = sorted(apts)
+    ranges = {apt: np.percentile(xs[apt], [10, 50, 90]) for n, apt in apts if apt in xs}
+    # The building ends act as observed apartments just before the first and after the last apartment number
+    anchors = [(apts[0][0] - 1, 0.0, 0.0)] + [(n, ranges[apt][0], ranges[apt][2]) for n, apt in apts if apt in ranges] + [(apts[-1][0] + 1, width, width)]
+    extents = []
+    for n, apt in apts:
+        if apt in ranges:
+            (lo, median, hi) = ranges[apt]
+            extents.append((float(median), float(lo), float(hi), apt))
+            continue
+        (n0, _, x0) = [a for a in anchors if a[0] < n][-1]
+        (n1, x1, _) = [a for a in anchors if a[0] > n][0]
+        x = float(x0 + (x1 - x0) * (n - n0) / (n1 - n0))
+        extents.append((x, x, x, apt))
+    extents.sort()
+    bounds = [0.0] + [(extents[i][2] + extents[i + 1][1]) / 2 for i in range(0, len(extents) - 1)] + [width]
+    bounds = np.clip(np.maximum.accumulate(bounds), 0.0, width)
+    return [(extents[i][3], float(bounds[i]), float(bounds[i + 1])) for i in range(0, len(extents))]
+
+def build_apartment_model(all_data, ap_path, side_split=None, depth=16.0, cell_size=1.0):
+    """Builds a spatial model of all apartments (build_apartments_labels and any other label in the data) as axis-aligned boxes. Floor heights come from AP z coordinates, building sides ('_B' below side_split, '_U' above) split the y axis, and apartments of one floor and side split the x axis (see _split_floor_side), so apartments never observed in the data still get a box.
+       Accepts: Labelled positioning data (list of snapshots), path to access points data, y coordinate splitting building sides (median AP y if None), building depth (y extent), grid cell size in meters
+       Returns:  Dictionary apartment model holding floor heights, apartment boxes and their box index
+    """
+    ap_names, ap_coords = load_access_points(ap_path)
+    heights = build_floor_heights(ap_names, ap_coords)
+    if side_split is None:
+        side_split = float(np.median(ap_coords[:, 1]))
+
+    xs = {}
+    width = float(ap_coords[:, 0].max())
+    for s in all_data:
+        for b in s['Beacons'].values():
+            apt = b['Appartement']
+            if not apt.startswith('APT'): continue
+            if apt not in xs: xs[apt] = []
+            xs[apt].append(b['Location'][0])
+            width = max(width, b['Location'][0])
+    width += cell_size
+
+    per_floor_side = {}
+    for apt in set(build_apartments_labels()) | set(xs):
+        parts = apt.split('_')
+        key = (int(parts[3]), parts[4])
+        if key not in per_floor_side: per_floor_side[key] = []
+        per_floor_side[key].append((int(parts[1]), apt))
+
+    names = []
+    mins = []
+    maxs = []
+    for (floor, side), apts in sorted(per_floor_side.items()):
+        if floor not in heights: continue
+        (z0, z1) = heights[floor]
+        (y0, y1) = (0.0, side_split) if side == 'B' else (side_split, depth)
+        for (apt, x0, x1) in _split_floor_side(apts, xs, width):
+            names.append(apt)
+            mins.append([x0, y0, z0])
+            maxs.append([x1, y1, z1])
+
+    return {
+        'floor_heights': heights,
+        'side_split': side_split,
+        'index': build_box_index(names, mins, maxs, cell_size)
+    }
+
+def assign_apartments(model, points, outside='OUTSIDE'):
+    """Assigns a batch of 3D locations to apartments in one vectorized pass
+       Accepts: Apartment model, numpy array or list of 3D locations, label for locations outside every apartment
+       Returns:  List of apartment labels
+    """
+    candidates, contained = query_box_index(model['index'], points)
+    first = np.argmax(contained, axis=1)
+    ids = candidates[np.arange(len(candidates)), first]
+    ids[~contained.any(axis=1)] = -1
+    names = np.asarray(model['index']['names'] + [outside], dtype=object)
+    return list(names[ids])
+
+def relabel_snapshots(model, all_data):
+    """Re-derives the 'Appartement' field of every beacon from its 'Location' (e.g. after smoothing), all locations are assigned in a single batch
+       Accepts: Apartment model, list of positioning snapshots
+       Returns:  List of positioning snapshots with re-derived 'Appartement' fields
+    """
+    points = []
+    for s in all_data:
+        for b in s['Beacons'].values():
+            points.append(b['Location'])
+    labels = assign_apartments(model, np.asarray(points).reshape(-1, 3))
+    relabelled = []
+    i = 0
+    for s in all_data:
+        new_s = {'Timestamp': s['Timestamp'], 'Beacons': {}}
+        for beacon_mac, b in s['Beacons'].items():
+            new_b = dict(b)
+            new_b['Appartement'] = labels[i]
+            new_s['Beacons'][beacon_mac] = new_b
+            i += 1
+        relabelled.append(new_s)
+    return relabelled
+
+def build_geofences(fences, cell_size=1.0):
+    """Builds a geofence index from named axis-aligned boxes (fences may overlap)
+       Accepts: Dictionary of fence name and tuple (minimum corner, maximum corner), grid cell size in meters
+       Returns:  Dictionary box index
+    """
+    names = list(fences.keys())
+    return build_box_index(names, [fences[n][0] for n in names], [fences[n][1] for n in names], cell_size)
+
+def apartment_geofences(model, apartments):
+    """Builds geofences from apartment boxes of the model (e.g. restricted apartments, GEMAT-style)
+       Accepts: Apartment model, list of apartment labels
+       Returns:  Dictionary of fence name and tuple (minimum corner, maximum corner), raises ValueError for apartments with no box
+    """
+    index = model['index']
+    unknown = sorted(set(apartments) - set(index['names']))
+    if len(unknown) > 0:
+        raise ValueError('Unknown apartments: {}'.format(unknown))
+    fences = {}
+    for i in range(0, len(index['names'])):
+        if index['names'][i] in apartments:
+            fences[index['names'][i]] = (index['mins'][i], index['maxs'][i])
+    return fences
+
+def check_geofences(fence_index, points):
+    """Checks a batch of 3D locations against all geofences in one vectorized pass
+       Accepts: Geofence box index, numpy array or list of 3D locations
+       Returns:  Boolean numpy array (points x fences), True where a location is inside a fence
+    """
+    candidates, contained = query_box_index(fence_index, points)
+    inside = np.zeros((len(candidates), len(fence_index['names'])), dtype=bool)
+    rows, cols = np.nonzero(contained)
+    inside[rows, candidates[rows, cols]] = True
+    return inside
+
+def measure_assignment(model, all_data):
+    """Measures apartment assignment time and agreement with upstream 'Appartement' labels over a whole dataset
+       Accepts: Apartment model, list of positioning snapshots (held-out from the data the model was built on)
+       Returns:  Double seconds taken, double accuracy (0-1)
+    """
+    points = []
+    labels = []
+    for s in all_data:
+        for b in s['Beacons'].values():
+            points.append(b['Location'])
+            labels.append(b['Appartement'])
+    points = np.asarray(points, dtype=np.float64)
+    start = time.time()
+    assigned = assign_apartments(model, points)
+    took = time.time() - start
+    accuracy = float(np.mean(np.asarray(assigned, dtype=object) == np.asarray(labels, dtype=object)))
+    print('Assigned {} locations in {} seconds, agreement with labels: {}'.format(len(points), took, accuracy))
+    return took, accuracy